@@ -1,41 +1,59 @@
-from contextlib import suppress
-from json import dump, load
-from os import makedirs, mkdir, remove
-from os.path import join
-from shutil import rmtree, copyfile, make_archive
-from typing import Iterable
-
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+from json import load
+from os import makedirs, remove, sep, walk
+from os.path import dirname, join, relpath
+from sys import argv
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+import numpy as np
+import orjson
 from PIL import Image
 
 
-def color_palette(texture: str) -> Image:
-    data = sorted(colors(texture), key=lambda c: sum(c), reverse=True)
-
-    if len(data) == 1:
-        data = list(data) * 8
+def analyze_texture(texture: str) -> tuple[Image, tuple[int, ...]]:
+    data, counts = colors(texture)
+    rgba = np.average(data, axis=0, weights=counts).astype(int)
+    return color_palette(data), tuple(rgba.tolist())
 
-    while len(data) > 8:
-        pixels = min(zip(data, data[2:]), key=lambda ps: sum(ps[0]) - sum(ps[1]))
-        index = data.index(pixels[0]) + 1
-        data.pop(index)
 
-    while len(data) < 8:
-        pixels = max(zip(data, data[1:]), key=lambda ps: sum(ps[0]) - sum(ps[1]))
-        index = data.index(pixels[1])
-        data.insert(index, tuple(c[1] + (c[0]-c[1]) // 2 for c in zip(pixels[0], pixels[1])))
+@lru_cache(maxsize=None)
+def blacklist() -> frozenset[str]:
+    with open('../update_1_20/data/minecraft/tags/items/trim_materials.json') as file:
+        return frozenset(load(file)['values']) | {'minecraft:air'}
 
-    result = Image.new('RGBA', (8, 1))
-    result.putdata(data)
-    return result
 
+def color_palette(data: np.ndarray) -> Image:
+    key = data.sum(axis=1, dtype=int)
+    order = np.argsort(-key, kind='stable')
+    data, key = data[order], key[order]
 
-def colors(texture: str) -> set[tuple[int]]:
+    if len(data) == 1:
+        data = data.repeat(8, axis=0)
+    elif len(data) > 8:
+        data = median_cut(data, 8)
+    elif len(data) < 8:
+        count = 8 - len(data)
+        gaps = (key[:-1] - key[1:])[:, None] / np.arange(1, count + 1)
+        splits = np.bincount(np.argsort(-gaps, axis=None, kind='stable')[:count] // count, minlength=len(gaps))
+        data = np.concatenate([
+            *(np.linspace(a, b, split + 1, endpoint=False) for a, b, split in zip(data, data[1:], splits)),
+            data[-1:]
+        ]).astype(np.uint8)
+
+    return Image.fromarray(data.reshape(1, 8, 4))
+
+
+def colors(texture: str) -> tuple[np.ndarray, np.ndarray]:
     with Image.open(texture) as image:
-        data = image.convert('RGBA').getdata()
-    return set(filter(lambda p: p[3] > 0, data))
+        image = image.convert('RGBA')
+        counts, data = zip(*image.getcolors(image.width * image.height))
+    data, counts = np.array(data, dtype=np.uint8), np.array(counts)
+    return data[data[:, 3] > 0], counts[data[:, 3] > 0]
 
 
-def create_atlas(path: str, atlas_name: str, index: int) -> None:
+def create_atlas(pack: dict[str, bytes], path: str, atlas_name: str, index: int) -> None:
     with open(f'../minecraft/atlases/{atlas_name}.json') as file:
         atlas = load(file)
 
@@ -43,69 +61,65 @@ def create_atlas(path: str, atlas_name: str, index: int) -> None:
     for item in items():
         permutations[item['name']] = f"super_trim:trims/color_palettes/{item['name']}"
 
-    with open(path, 'x') as file:
-        dump(atlas, file, indent=2)
-
+    pack[path] = orjson.dumps(atlas, option=orjson.OPT_INDENT_2)
 
-def create_color_palettes(path: str) -> None:
-    refresh_dir(path)
 
+def create_color_palettes(pack: dict[str, bytes], path: str) -> None:
     for item in items():
         if item['texture'] is not None:
-            color_palette(texture_path(item['texture'])).save(join(path, f"{item['name']}.png"))
+            with BytesIO() as file:
+                textures()[item['texture']][0].save(file, 'PNG')
+                pack[f"{path}/{item['name']}.png"] = file.getvalue()
 
 
-def create_datapack(path: str) -> None:
-    print('Preparing datapack...')
-    refresh_dir(path)
+def create_datapack(path: str, extract: bool) -> None:
+    pack = {}
 
     print('Creating pack.mcmeta...')
-    create_mcmeta(path, 'Enables all items as armor trimming materials', 11)
+    create_mcmeta(pack, 'Enables all items as armor trimming materials', 11)
 
     print('Creating trim_materials.json...')
-    makedirs(join(path, 'data/minecraft/tags/items'))
-    create_tag(join(path, 'data/minecraft/tags/items/trim_materials.json'))
+    create_tag(pack, 'data/minecraft/tags/items/trim_materials.json')
 
     print('Creating materials...')
-    makedirs(join(path, 'data/super_trim/trim_material'))
     for item in items():
-        create_material(join(path, 'data/super_trim/trim_material'), item)
+        create_material(pack, 'data/super_trim/trim_material', item)
 
     print('Creating pack.png...')
-    copyfile('../pack.png', join(path, 'pack.png'))
+    pack['pack.png'] = pack_png()
 
     print('Creating Super Trim.zip...')
-    with suppress(FileNotFoundError):
-        remove('../Super Trim.zip')
-    make_archive('../Super Trim', 'zip', '../datapack')
+    write_zip('../Super Trim.zip', pack)
+
+    if extract:
+        print('Extracting datapack...')
+        write_dir(path, pack)
 
     print('Datapack ready')
 
 
-def create_lang(path: str) -> None:
+def create_lang(pack: dict[str, bytes], path: str) -> None:
     with open('../minecraft/lang/en_us.json') as file:
         lang = load(file)
 
+    names = {k.removeprefix('block.minecraft.'): v for k, v in lang.items() if k.startswith('block.minecraft.')}
+    names |= {k.removeprefix('item.minecraft.'): v for k, v in lang.items() if k.startswith('item.minecraft.')}
+
     result = {}
 
     for item in items():
-        try:
-            display_name = lang[f"item.minecraft.{item['name']}"]
-        except KeyError:
-            if item['name'].endswith('_smithing_template'):
-                display_name = 'Smithing Template'
-            else:
-                display_name = lang[f"block.minecraft.{item['name']}"]
+        if item['name'] not in names and item['name'].endswith('_smithing_template'):
+            display_name = 'Smithing Template'
+        else:
+            display_name = names[item['name']]
 
         result[f"trim_material.minecraft.{item['name']}"] = f'{display_name} Material'
     
-    with open(path, 'x') as file:
-        dump(result, file, indent=2)
+    pack[path] = orjson.dumps(result, option=orjson.OPT_INDENT_2)
 
 
-def create_material(path: str, item: dict[str, str]) -> None:
-    rgba = zip(*colors(texture_path(item['texture'])))
-    rgba = tuple(map(lambda c: sum(c) // len(c), rgba))
+def create_material(pack: dict[str, bytes], path: str, item: dict[str, str]) -> None:
+    rgba = textures()[item['texture']][1]
 
     material = {
         'asset_name': item['name'],
@@ -117,81 +131,114 @@ def create_material(path: str, item: dict[str, str]) -> None:
         'item_model_index': 1.0
     }
 
-    with open(join(path, f"{item['name']}.json"), 'x') as file:
-        dump(material, file, indent=2)
+    pack[f"{path}/{item['name']}.json"] = orjson.dumps(material, option=orjson.OPT_INDENT_2)
 
 
-def create_mcmeta(path: str, description: str, pack_format: int) -> None:
-    with open(join(path, 'pack.mcmeta'), 'x') as file:
-        dump({
-            'pack': {
-                'description': description,
-                'pack_format': pack_format
-            }
-        }, file, indent=2)
+def create_mcmeta(pack: dict[str, bytes], description: str, pack_format: int) -> None:
+    pack['pack.mcmeta'] = orjson.dumps({
+        'pack': {
+            'description': description,
+            'pack_format': pack_format
+        }
+    }, option=orjson.OPT_INDENT_2)
 
 
-def create_resourcepack(path: str) -> None:
-    print('Preparing resource pack...')
-    refresh_dir(path)
+def create_resourcepack(path: str, extract: bool) -> None:
+    pack = {}
 
     print('Creating pack.mcmeta...')
-    create_mcmeta(path, 'Resource pack for the Super Trim data pack', 12)
+    create_mcmeta(pack, 'Resource pack for the Super Trim data pack', 12)
 
     print('Creating armor_trims.json...')
-    makedirs(join(path, 'assets/minecraft/atlases'))
-    create_atlas(join(path, 'assets/minecraft/atlases/armor_trims.json'), 'armor_trims', 0)
+    create_atlas(pack, 'assets/minecraft/atlases/armor_trims.json', 'armor_trims', 0)
 
     print('Creating color palettes...')
-    makedirs(join(path, 'assets/super_trim/textures/trims/color_palettes'))
-    create_color_palettes(join(path, 'assets/super_trim/textures/trims/color_palettes'))
+    create_color_palettes(pack, 'assets/super_trim/textures/trims/color_palettes')
 
     print('Creating en_us.json...')
-    makedirs(join(path, 'assets/minecraft/lang'))
-    create_lang(join(path, 'assets/minecraft/lang', 'en_us.json'))
+    create_lang(pack, 'assets/minecraft/lang/en_us.json')
 
     print('Creating pack.png...')
-    copyfile('../pack.png', join(path, 'pack.png'))
+    pack['pack.png'] = pack_png()
 
     print('Creating Super Trim - Resources.zip...')
-    with suppress(FileNotFoundError):
-        remove('../Super Trim - Resources.zip')
-    make_archive('../Super Trim - Resources', 'zip', '../resourcepack')
+    write_zip('../Super Trim - Resources.zip', pack)
+
+    if extract:
+        print('Extracting resource pack...')
+        write_dir(path, pack)
 
     print('Resource pack ready')
 
 
-def create_tag(path: str) -> None:
+def create_tag(pack: dict[str, bytes], path: str) -> None:
     tag = {'values': []}
     for item in items():
         tag['values'].append(f"minecraft:{item['name']}")
     
-    with open(path, 'x') as file:
-        dump(tag, file, indent=2)
+    pack[path] = orjson.dumps(tag, option=orjson.OPT_INDENT_2)
 
 
-def items() -> Iterable[dict[str, str]]:
-    with open('../update_1_20/data/minecraft/tags/items/trim_materials.json') as file:
-        blacklist: list[str] = load(file)['values']
-    blacklist.append('minecraft:air')
-
+@lru_cache(maxsize=None)
+def items() -> tuple[dict[str, str], ...]:
     with open('items.json') as file:
-        return filter(lambda i: f"minecraft:{i['name']}" not in blacklist, load(file))
+        return tuple(filter(lambda i: f"minecraft:{i['name']}" not in blacklist(), load(file)))
+
 
+def median_cut(data: np.ndarray, count: int) -> np.ndarray:
+    boxes = [data]
+    while len(boxes) < count:
+        box = boxes.pop(max(range(len(boxes)), key=lambda i: np.ptp(boxes[i], axis=0).max()))
+        box = box[box[:, np.ptp(box, axis=0).argmax()].argsort()]
+        boxes += box[:len(box) // 2], box[len(box) // 2:]
 
-def refresh_dir(path: str) -> None:
-    rmtree(path, ignore_errors=True)
-    mkdir(path)
+    result = np.array([box.mean(axis=0) for box in boxes]).round().astype(np.uint8)
+    return result[np.argsort(-result.sum(axis=1, dtype=int), kind='stable')]
 
 
-def texture_path(namespaced_path: str):
-    try:
-        namespace, path = namespaced_path.split(':')
-    except ValueError:
+@lru_cache(maxsize=None)
+def pack_png() -> bytes:
+    with open('../pack.png', 'rb') as file:
+        return file.read()
+
+
+@lru_cache(maxsize=None)
+def textures() -> dict[str, tuple[Image, tuple[int, ...]]]:
+    paths = {item['texture']: texture_path(item['texture']) for item in items() if item['texture'] is not None}
+    with ProcessPoolExecutor() as executor:
+        return dict(zip(paths, executor.map(analyze_texture, paths.values(), chunksize=16)))
+
+
+def texture_path(namespaced_path: str) -> str:
+    namespace, separator, path = namespaced_path.partition(':')
+    if not separator:
         namespace, path = 'minecraft', namespaced_path
     return join('..', namespace, 'textures', f'{path}.png')
 
 
+def write_dir(path: str, pack: dict[str, bytes]) -> None:
+    for root, _, files in walk(path):
+        for file in files:
+            if relpath(join(root, file), path).replace(sep, '/') not in pack:
+                remove(join(root, file))
+
+    for directory in {dirname(name) for name in pack}:
+        makedirs(join(path, directory), exist_ok=True)
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(write_file, (join(path, name) for name in pack), pack.values()))
+
+
+def write_file(path: str, data: bytes) -> None:
+    with open(path, 'wb', buffering=0) as file:
+        file.write(data)
+
+
+def write_zip(path: str, pack: dict[str, bytes]) -> None:
+    with ZipFile(path, 'w', ZIP_DEFLATED, compresslevel=1) as file:
+        for name, data in pack.items():
+            file.writestr(name, data, ZIP_STORED if name.endswith('.png') else ZIP_DEFLATED)
+
+
 if __name__ == '__main__':
-    create_datapack('../datapack')
-    create_resourcepack('../resourcepack')
+    create_datapack('../datapack', '--extract' in argv)
+    create_resourcepack('../resourcepack', '--extract' in argv)